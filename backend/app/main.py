@@ -1,19 +1,34 @@
-﻿from datetime import datetime
-from typing import List
-
-from fastapi import FastAPI
+﻿import asyncio
+import hashlib
+import logging
+import logging.handlers
+import queue
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+import orjson
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+
+# Load .env (GEMINI_API_KEY, REDIS_URL, ...) once, at the single entry point,
+# before the service modules read their settings at import time.
+load_dotenv()
 
-from app.services.arxiv_client import search_arxiv
+from app.services.arxiv_client import create_session, search_arxiv
 from app.services.astro_math import (
-    schwarzschild_radius_km,
-    kepler_orbital_period_days,
+    schwarzschild_radius_km_array,
+    kepler_orbital_period_days_array,
 )
-from app.services.gemini_client import generate_report
+from app.services.gemini_client import generate_report, generate_report_stream
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS for frontend (dev + prod)
 app.add_middleware(
@@ -22,9 +37,50 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
+def _start_logging() -> Tuple[logging.Handler, logging.handlers.QueueListener]:
+    """
+    Request-path code only enqueues log records; a background thread does the
+    actual (blocking) write to stderr.
+    """
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    )
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    logging.getLogger().addHandler(queue_handler)
+    # Only our own modules are raised to INFO; other libraries keep their levels
+    logging.getLogger("app").setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return queue_handler, listener
+
+
+def _stop_logging(queue_handler: logging.Handler, listener: logging.handlers.QueueListener) -> None:
+    # Detach first so nothing is enqueued after the listener stops reading
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+
+
+@app.on_event("startup")
+async def _startup():
+    app.state.log_handler, app.state.log_listener = _start_logging()
+    app.state.http = create_session()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await app.state.http.close()
+    _stop_logging(app.state.log_handler, app.state.log_listener)
+
+
 # --------- MODELS ---------
 
 
@@ -55,8 +111,32 @@ class AnalyzeTopicResponse(BaseModel):
     future_work: str
 
 
+# Built once; validating / dumping a whole list goes through a single call
+_paper_list_adapter = TypeAdapter(List[PaperSummary])
+_calculation_list_adapter = TypeAdapter(List[CalculationResult])
+
+
 # --------- HELPERS ---------
 
+# Topic keywords → how many arXiv papers to fetch (substring match, like before).
+_BROAD_TOPICS = frozenset({"universe", "cosmology", "astrophysics"})
+_MID_TOPICS = frozenset({"dark matter", "dark energy", "inflation", "structure formation"})
+_MEDIUM_TOPICS = frozenset({"galaxy", "exoplanet", "planet", "accretion", "supernova"})
+
+_PAPERS_BY_KEYWORD = {
+    **{k: 5 for k in _MEDIUM_TOPICS},
+    **{k: 6 for k in _MID_TOPICS},
+    **{k: 8 for k in _BROAD_TOPICS},
+}
+
+
+def _keyword_re(keywords) -> "re.Pattern[str]":
+    # Longest first so e.g. "exoplanet" wins over "planet"
+    return re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+
+_MAX_PAPERS_RE = _keyword_re(_PAPERS_BY_KEYWORD)
+
 
 def decide_max_papers(topic: str) -> int:
     """
@@ -65,138 +145,218 @@ def decide_max_papers(topic: str) -> int:
     """
     t = topic.lower()
 
-    # Extremely broad topics
-    if any(x in t for x in ["universe", "cosmology", "astrophysics"]):
-        return 8
+    # Broadest matching keyword wins; narrow / specific topics get 3
+    return max(
+        (_PAPERS_BY_KEYWORD[m] for m in _MAX_PAPERS_RE.findall(t)),
+        default=3,
+    )
 
-    # Broad cosmology / fundamental physics topics
-    if any(x in t for x in ["dark matter", "dark energy", "inflation", "structure formation"]):
-        return 6
 
-    # Medium complexity astrophysics topics
-    if any(x in t for x in ["galaxy", "exoplanet", "planet", "accretion", "supernova"]):
-        return 5
+# (mass in solar masses, label suffix, details template) for the black hole calculations
+_BLACK_HOLE_CASES = (
+    (10.0, "stellar-mass black hole", "Event horizon radius for a {mass} M☉ black hole."),
+    (
+        4e6,  # like Sgr A*
+        "supermassive black hole",
+        "Event horizon radius for a {mass:.1e} M☉ "
+        "supermassive black hole (similar to the Milky Way's center).",
+    ),
+)
+_BLACK_HOLE_MASSES = np.array([mass for mass, _, _ in _BLACK_HOLE_CASES])
 
-    # Narrow / specific topics
-    return 3
+# (semi-major axis in AU, details) around a Sun-like star
+_ORBIT_CASES = (
+    (1.0, "Approximate orbital period of an Earth-like orbit around a Sun-like star."),
+    (5.0, "Approximate orbital period for a Jupiter-like orbit around a Sun-like star."),
+)
+_ORBIT_DISTANCES_AU = np.array([a_au for a_au, _ in _ORBIT_CASES])
 
 
-# --------- ROUTES ---------
+# arXiv always uses YYYY-MM-DDTHH:MM:SSZ
+_ARXIV_TIMESTAMP_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})Z?$")
 
 
-@app.get("/health")
-def health():
-    return {"status": "ok"}
+def parse_arxiv_datetime(value: str) -> datetime:
+    """
+    Parse an arXiv timestamp as UTC, falling back to "now" if it is malformed.
+    """
+    m = _ARXIV_TIMESTAMP_RE.match(value)
+    if m:
+        try:
+            return datetime(*map(int, m.groups()), tzinfo=timezone.utc)
+        except ValueError:
+            # right shape, impossible date (e.g. month 13)
+            pass
+    return datetime.now(timezone.utc)
 
 
-@app.post("/api/analyze-topic", response_model=AnalyzeTopicResponse)
-def analyze_topic(payload: AnalyzeTopicRequest):
-    # 1) Decide how many papers to fetch based on topic
-    max_p = decide_max_papers(payload.topic)
+def _black_hole_calculations() -> List[CalculationResult]:
+    radii_km = schwarzschild_radius_km_array(_BLACK_HOLE_MASSES)
 
-    # 2) Fetch papers from arXiv
-    entries = search_arxiv(payload.topic, max_p)
+    return [
+        CalculationResult(
+            label=f"Schwarzschild radius ({name})",
+            value=f"{rs_km:,.2f} km",
+            details=details.format(mass=mass),
+        )
+        for (mass, name, details), rs_km in zip(_BLACK_HOLE_CASES, radii_km.tolist())
+    ]
 
-    papers: List[PaperSummary] = []
 
-    for e in entries:
-        published_raw = e.get("published") or ""
-        # arXiv uses ISO with 'Z' at the end -> convert to +00:00 for fromisoformat
-        if published_raw.endswith("Z"):
-            published_raw = published_raw.replace("Z", "+00:00")
+def _orbit_calculations() -> List[CalculationResult]:
+    periods_days = kepler_orbital_period_days_array(_ORBIT_DISTANCES_AU, 1.0)
 
-        try:
-            published_dt = datetime.fromisoformat(published_raw)
-        except Exception:
-            # fallback if parsing fails
-            published_dt = datetime.utcnow()
-
-        papers.append(
-            PaperSummary(
-                title=e.get("title", ""),
-                authors=e.get("authors", []),
-                summary=e.get("summary", ""),
-                url=e.get("url", ""),
-                published=published_dt,
-            )
+    return [
+        CalculationResult(
+            label=f"Orbital period at {a_au:g} AU",
+            value=f"{p_days:.1f} days",
+            details=details,
         )
+        for (a_au, details), p_days in zip(_ORBIT_CASES, periods_days.tolist())
+    ]
+
+
+# Keyword → calculation builder. Black holes take priority over orbits
+# when a topic mentions both.
+_CALCULATION_BUILDERS = {
+    "black hole": _black_hole_calculations,
+    "orbit": _orbit_calculations,
+    "exoplanet": _orbit_calculations,
+    "planet": _orbit_calculations,
+}
+_CALCULATION_RE = _keyword_re(_CALCULATION_BUILDERS)
 
+
+def build_calculations(topic_lower: str) -> List[CalculationResult]:
+    """
+    Topic-based calculations ONLY where it makes sense:
+    dark matter, inflation, CMB, etc → no random BH calcs.
+    """
+    matches = set(_CALCULATION_RE.findall(topic_lower))
+    if not matches:
+        return []
+    if "black hole" in matches:
+        return _black_hole_calculations()
+    return _CALCULATION_BUILDERS[matches.pop()]()
+
+
+async def collect_sources(
+    payload: AnalyzeTopicRequest,
+    session: aiohttp.ClientSession,
+) -> Tuple[List[PaperSummary], List[CalculationResult]]:
+    """
+    Everything the report is built from: arXiv papers + topic calculations.
+    """
     topic_lower = payload.topic.lower()
-    calculations: List[CalculationResult] = []
-
-    # 3) Topic-based calculations ONLY where it makes sense
-    if "black hole" in topic_lower:
-        mass_stellar = 10.0          # solar masses
-        mass_supermassive = 4e6      # solar masses (like Sgr A*)
-
-        rs_stellar_km = schwarzschild_radius_km(mass_stellar)
-        rs_supermassive_km = schwarzschild_radius_km(mass_supermassive)
-
-        calculations.append(
-            CalculationResult(
-                label="Schwarzschild radius (stellar-mass black hole)",
-                value=f"{rs_stellar_km:,.2f} km",
-                details=f"Event horizon radius for a {mass_stellar} M☉ black hole.",
-            )
-        )
 
-        calculations.append(
-            CalculationResult(
-                label="Schwarzschild radius (supermassive black hole)",
-                value=f"{rs_supermassive_km:,.2f} km",
-                details=(
-                    f"Event horizon radius for a {mass_supermassive:.1e} M☉ "
-                    "supermassive black hole (similar to the Milky Way's center)."
-                ),
-            )
-        )
+    # 1) Decide how many papers to fetch based on topic
+    max_p = decide_max_papers(topic_lower)
 
-    elif "orbit" in topic_lower or "exoplanet" in topic_lower or "planet" in topic_lower:
-        p_1au_days = kepler_orbital_period_days(1.0, 1.0)
-        p_5au_days = kepler_orbital_period_days(5.0, 1.0)
+    # 2) Start the arXiv fetch; the calculations below only depend on the
+    #    topic, so they run while the request is in flight. Additional
+    #    sources can be awaited alongside it with asyncio.gather(...).
+    arxiv_task = asyncio.create_task(search_arxiv(payload.topic, max_p, session))
+    await asyncio.sleep(0)  # let the task send its request before we compute
 
-        calculations.append(
-            CalculationResult(
-                label="Orbital period at 1 AU",
-                value=f"{p_1au_days:.1f} days",
-                details="Approximate orbital period of an Earth-like orbit around a Sun-like star.",
-            )
-        )
+    # 3) Topic-based calculations
+    calculations = build_calculations(topic_lower)
+
+    entries = await arxiv_task
+
+    paper_dicts = []
 
-        calculations.append(
-            CalculationResult(
-                label="Orbital period at 5 AU",
-                value=f"{p_5au_days:.1f} days",
-                details="Approximate orbital period for a Jupiter-like orbit around a Sun-like star.",
-            )
+    for e in entries:
+        published_dt = parse_arxiv_datetime(e.get("published") or "")
+
+        paper_dicts.append(
+            {
+                "title": e.get("title", ""),
+                "authors": e.get("authors", []),
+                "summary": e.get("summary", ""),
+                "url": e.get("url", ""),
+                "published": published_dt,
+            }
         )
 
-    else:
-        # dark matter, inflation, CMB, etc → no random BH calcs
-        calculations = []
+    # One validation pass for the whole list
+    papers = _paper_list_adapter.validate_python(paper_dicts)
 
-    # 4) Call Gemini to generate overview + future_work
-    papers_for_llm = []
-    for p in papers:
-        d = p.model_dump()
-        d["published"] = p.published.isoformat()
-        papers_for_llm.append(d)
+    return papers, calculations
 
-    calcs_for_llm = [c.model_dump() for c in calculations]
 
-    sections = generate_report(payload.topic, papers_for_llm, calcs_for_llm) or {}
+def llm_inputs(
+    papers: List[PaperSummary],
+    calculations: List[CalculationResult],
+) -> Tuple[List[dict], List[dict]]:
+    # mode="json" renders `published` as an ISO string for the prompt
+    papers_for_llm = _paper_list_adapter.dump_python(papers, mode="json")
+    calcs_for_llm = _calculation_list_adapter.dump_python(calculations)
+    return papers_for_llm, calcs_for_llm
 
-    overview = sections.get("overview") or (
-        f"This report is based on {len(papers)} arXiv result(s) for the topic "
-        f"'{payload.topic}'. The summaries below are extracted directly from "
+
+def fallback_overview(topic: str, n_papers: int) -> str:
+    return (
+        f"This report is based on {n_papers} arXiv result(s) for the topic "
+        f"'{topic}'. The summaries below are extracted directly from "
         "the arXiv abstracts."
     )
 
-    future_work = sections.get("future_work") or (
-        "Future work may include deeper analysis of recent literature, "
-        "more detailed astrophysical modelling, and cross-correlation "
-        "with multi-messenger or multi-wavelength observations where relevant."
-    )
+
+FALLBACK_FUTURE_WORK = (
+    "Future work may include deeper analysis of recent literature, "
+    "more detailed astrophysical modelling, and cross-correlation "
+    "with multi-messenger or multi-wavelength observations where relevant."
+)
+
+
+def report_etag(topic: str) -> str:
+    """
+    Weak ETag for a report: the normalised topic (same key as the arXiv cache)
+    bucketed by day.
+    """
+    key = f"{topic.lower().strip()}|{date.today().isoformat()}"
+    return f'W/"{hashlib.sha256(key.encode()).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore W/ prefixes, accept a comma-separated list
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in if_none_match.split(","))
+
+
+# --------- ROUTES ---------
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.post("/api/analyze-topic", response_model=AnalyzeTopicResponse)
+async def analyze_topic(payload: AnalyzeTopicRequest, request: Request, response: Response):
+    # Same topic on the same day → client already has this report
+    etag = report_etag(payload.topic)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    papers, calculations = await collect_sources(payload, request.app.state.http)
+
+    # 4) Call Gemini to generate overview + future_work
+    papers_for_llm, calcs_for_llm = llm_inputs(papers, calculations)
+
+    sections = await generate_report(payload.topic, papers_for_llm, calcs_for_llm) or {}
+
+    overview = sections.get("overview") or fallback_overview(payload.topic, len(papers))
+    future_work = sections.get("future_work") or FALLBACK_FUTURE_WORK
+
+    # Only let clients pin complete reports; a degraded one (arXiv returned
+    # nothing, or Gemini fell back to canned text) should be retried.
+    if papers and sections.get("overview") and sections.get("future_work"):
+        response.headers["ETag"] = etag
 
     return AnalyzeTopicResponse(
         topic=payload.topic,
@@ -205,3 +365,44 @@ def analyze_topic(payload: AnalyzeTopicRequest):
         calculations=calculations,
         future_work=future_work,
     )
+
+
+@app.post("/api/analyze-topic/stream")
+async def analyze_topic_stream(payload: AnalyzeTopicRequest, request: Request):
+    """
+    Same report as /api/analyze-topic, streamed as NDJSON so the UI can render
+    before Gemini finishes:
+
+      {"topic": ..., "papers": [...], "calculations": [...]}
+      {"overview_delta": "..."}       (repeated)
+      {"future_work_delta": "..."}    (repeated)
+    """
+    papers, calculations = await collect_sources(payload, request.app.state.http)
+    papers_for_llm, calcs_for_llm = llm_inputs(papers, calculations)
+
+    async def frames():
+        yield orjson.dumps(
+            {
+                "topic": payload.topic,
+                "papers": papers_for_llm,
+                "calculations": calcs_for_llm,
+            }
+        ) + b"\n"
+
+        streamed = set()
+        async for section, delta in generate_report_stream(
+            payload.topic, papers_for_llm, calcs_for_llm
+        ):
+            if section == "future_work" and "overview" not in streamed:
+                # Model skipped straight to future work
+                yield orjson.dumps({"overview_delta": fallback_overview(payload.topic, len(papers))}) + b"\n"
+                streamed.add("overview")
+            streamed.add(section)
+            yield orjson.dumps({f"{section}_delta": delta}) + b"\n"
+
+        if "overview" not in streamed:
+            yield orjson.dumps({"overview_delta": fallback_overview(payload.topic, len(papers))}) + b"\n"
+        if "future_work" not in streamed:
+            yield orjson.dumps({"future_work_delta": FALLBACK_FUTURE_WORK}) + b"\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
@@ -1,15 +1,80 @@
-import httpx
-from xml.etree import ElementTree as ET
+import asyncio
+import io
+import logging
+import ssl
+import time
+
+import aiohttp
+from cachetools import TTLCache
+from lxml import etree
 
 ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ARXIV_TIMEOUT = aiohttp.ClientTimeout(total=20.0)  # more relaxed timeout
+
+# arXiv returns Atom XML
+ATOM_NS = {"atom": "http://www.w3.org/2005/Atom"}
+ATOM_ENTRY = "{http://www.w3.org/2005/Atom}entry"
+
+logger = logging.getLogger(__name__)
+
+# (normalised topic, max_results) -> (fetched_at, results)
+ARXIV_CACHE_TTL = 3600.0
+_search_cache: TTLCache = TTLCache(maxsize=512, ttl=ARXIV_CACHE_TTL)
+_refreshing: set = set()
+_background_tasks: set = set()
 
+# Built once and shared by every connection (loading CA certs is not free)
+_SSL_CONTEXT = ssl.create_default_context()
 
-def search_arxiv(topic: str, max_results: int = 3):
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Process-wide pooled session for arXiv, created by the FastAPI startup hook
+    (app.state.http) so keep-alive connections are reused across requests.
+    Must be called from inside the running event loop.
+    """
+    connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=75, ssl=_SSL_CONTEXT)
+    return aiohttp.ClientSession(connector=connector, timeout=ARXIV_TIMEOUT)
+
+
+async def search_arxiv(topic: str, max_results: int, session: aiohttp.ClientSession):
     """
     Search arXiv for a given topic and return a list of dicts:
     { title, summary, authors, url, published }
     If the request fails or times out, return an empty list instead of crashing.
+
+    Results are cached per (topic, max_results) for an hour. Once an entry is
+    older than half its TTL it is still served, but refreshed in the background.
     """
+    key = (topic.lower().strip(), max_results)
+    cached = _search_cache.get(key)
+
+    if cached is not None:
+        fetched_at, results = cached
+        if time.monotonic() - fetched_at > ARXIV_CACHE_TTL / 2 and key not in _refreshing:
+            _refreshing.add(key)
+            task = asyncio.create_task(_refresh(key, topic, max_results, session))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        return results
+
+    results = await _fetch_arxiv(topic, max_results, session)
+    if results:
+        # Don't cache failures / empty result sets
+        _search_cache[key] = (time.monotonic(), results)
+    return results
+
+
+async def _refresh(key, topic: str, max_results: int, session: aiohttp.ClientSession) -> None:
+    try:
+        results = await _fetch_arxiv(topic, max_results, session)
+        if results:
+            _search_cache[key] = (time.monotonic(), results)
+    finally:
+        _refreshing.discard(key)
+
+
+async def _fetch_arxiv(topic: str, max_results: int, session: aiohttp.ClientSession):
     params = {
         "search_query": f"all:{topic}",
         "start": 0,
@@ -17,49 +82,57 @@ def search_arxiv(topic: str, max_results: int = 3):
     }
 
     try:
-        resp = httpx.get(
-            ARXIV_API_URL,
-            params=params,
-            timeout=20.0,          # more relaxed timeout
-            follow_redirects=True, # handle http -> https or other redirects
-        )
-        resp.raise_for_status()
-    except httpx.RequestError as e:
-        # Network / timeout error – log and return no results
-        print(f"[arxiv] request error: {e}")
-        return []
-    except httpx.HTTPStatusError as e:
+        # aiohttp follows redirects (http -> https etc.) by default
+        async with session.get(ARXIV_API_URL, params=params) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+    except aiohttp.ClientResponseError as e:
         # Non-2xx status – log and return no results
-        print(f"[arxiv] bad status: {e}")
+        logger.warning("arxiv bad status: %s", e)
+        return []
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        # Network / timeout error – log and return no results
+        logger.exception("arxiv request error")
         return []
 
-    # arXiv returns Atom XML
-    root = ET.fromstring(resp.text)
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
+    # Parsing holds the GIL for a while on large feeds; keep it off the event loop
+    return await asyncio.to_thread(parse_arxiv_atom, data)
+
 
+def parse_arxiv_atom(data: bytes):
+    """
+    Stream-parse an arXiv Atom feed, building one dict per <entry> as it closes
+    and freeing each element afterwards.
+    """
     results = []
 
-    for entry in root.findall("atom:entry", ns):
-        title = entry.findtext("atom:title", default="", namespaces=ns).strip()
-        summary = entry.findtext("atom:summary", default="", namespaces=ns).strip()
-        published = entry.findtext("atom:published", default="", namespaces=ns).strip()
-
-        link_el = entry.find("atom:link[@rel='alternate']", ns)
-        url = link_el.get("href") if link_el is not None else ""
-
-        authors = [
-            a.findtext("atom:name", default="", namespaces=ns).strip()
-            for a in entry.findall("atom:author", ns)
-        ]
-
-        results.append(
-            {
-                "title": title,
-                "summary": summary,
-                "published": published,
-                "url": url,
-                "authors": authors,
-            }
-        )
+    try:
+        for _, entry in etree.iterparse(io.BytesIO(data), events=("end",), tag=ATOM_ENTRY):
+            title = entry.findtext("atom:title", default="", namespaces=ATOM_NS).strip()
+            summary = entry.findtext("atom:summary", default="", namespaces=ATOM_NS).strip()
+            published = entry.findtext("atom:published", default="", namespaces=ATOM_NS).strip()
+
+            link_el = entry.find("atom:link[@rel='alternate']", ATOM_NS)
+            url = link_el.get("href") if link_el is not None else ""
+
+            authors = [
+                a.findtext("atom:name", default="", namespaces=ATOM_NS).strip()
+                for a in entry.findall("atom:author", ATOM_NS)
+            ]
+
+            results.append(
+                {
+                    "title": title,
+                    "summary": summary,
+                    "published": published,
+                    "url": url,
+                    "authors": authors,
+                }
+            )
+
+            entry.clear()
+    except etree.XMLSyntaxError as e:
+        # Truncated / malformed feed – keep whatever entries parsed cleanly
+        logger.warning("arxiv bad XML: %s", e)
 
     return results
@@ -1,11 +1,18 @@
 import math
 
+import numpy as np
+
 # Physical constants (SI units)
 G = 6.67430e-11            # gravitational constant, m^3 kg^-1 s^-2
 C = 2.99792458e8           # speed of light, m/s
 M_SUN = 1.98847e30         # mass of the Sun, kg
 AU = 1.495978707e11        # astronomical unit, m
 YEAR_SEC = 365.25 * 24 * 3600  # seconds in a year
+DAYS_PER_YEAR = 365.25
+
+# Precomputed Schwarzschild radius per solar mass: 2 G M_sun / c^2
+RS_PER_SOLAR_MASS_M = 2.0 * G * M_SUN / (C * C)
+RS_PER_SOLAR_MASS_KM = RS_PER_SOLAR_MASS_M / 1000.0
 
 
 def schwarzschild_radius_solar_masses(mass_solar: float) -> float:
@@ -17,16 +24,14 @@ def schwarzschild_radius_solar_masses(mass_solar: float) -> float:
     :param mass_solar: mass in units of solar masses
     :return: radius in meters
     """
-    mass_kg = mass_solar * M_SUN
-    rs = 2 * G * mass_kg / (C ** 2)
-    return rs
+    return mass_solar * RS_PER_SOLAR_MASS_M
 
 
 def schwarzschild_radius_km(mass_solar: float) -> float:
     """
     Convenience wrapper: Schwarzschild radius in kilometers.
     """
-    return schwarzschild_radius_solar_masses(mass_solar) / 1000.0
+    return mass_solar * RS_PER_SOLAR_MASS_KM
 
 
 def kepler_orbital_period_years(a_au: float, star_mass_solar: float = 1.0) -> float:
@@ -47,7 +52,7 @@ def kepler_orbital_period_years(a_au: float, star_mass_solar: float = 1.0) -> fl
     if star_mass_solar <= 0:
         raise ValueError("Star mass must be positive")
 
-    p_years = math.sqrt((a_au ** 3) / star_mass_solar)
+    p_years = math.sqrt(a_au * a_au * a_au / star_mass_solar)
     return p_years
 
 
@@ -56,4 +61,24 @@ def kepler_orbital_period_days(a_au: float, star_mass_solar: float = 1.0) -> flo
     Orbital period in days, convenience wrapper.
     """
     p_years = kepler_orbital_period_years(a_au, star_mass_solar)
-    return p_years * 365.25
+    return p_years * DAYS_PER_YEAR
+
+
+def schwarzschild_radius_km_array(masses_solar: np.ndarray) -> np.ndarray:
+    """
+    Vectorised schwarzschild_radius_km for a grid of masses (solar masses).
+    """
+    return np.asarray(masses_solar, dtype=float) * RS_PER_SOLAR_MASS_KM
+
+
+def kepler_orbital_period_days_array(a_au: np.ndarray, star_mass_solar=1.0) -> np.ndarray:
+    """
+    Vectorised kepler_orbital_period_days. Both arguments broadcast, so a single
+    star mass can be paired with many semi-major axes.
+    """
+    a = np.asarray(a_au, dtype=float)
+    m = np.asarray(star_mass_solar, dtype=float)
+    if np.any(m <= 0):
+        raise ValueError("Star mass must be positive")
+
+    return np.sqrt(a * a * a / m) * DAYS_PER_YEAR
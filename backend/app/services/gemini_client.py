@@ -1,76 +1,39 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+import functools
+import logging
 import os
+import re
 
-from dotenv import load_dotenv
-import google.generativeai as genai
+from aiolimiter import AsyncLimiter
 
-# Load .env for GEMINI_API_KEY in local dev
-load_dotenv()
+from app.services.llm_cache import cache_key, report_cache, semantic_cache
 
-api_key = os.getenv("GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
 
+MODEL_NAME = "gemini-2.5-flash"
+EMBEDDING_MODEL = "models/text-embedding-004"
 
-def generate_report(
-    topic: str,
-    papers: List[Dict[str, Any]],
-    calculations: List[Dict[str, Any]],
-) -> Dict[str, str]:
-    """
-    Ask Gemini to generate a structured scientific report.
+# Client-side quota, so bursts queue here instead of round-tripping into a 429.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+gemini_request_limiter = AsyncLimiter(max_rate=GEMINI_RPM, time_period=60)
+gemini_token_limiter = AsyncLimiter(max_rate=GEMINI_TPM, time_period=60)
 
-    Returns:
-      {
-        "overview": "<main narrative + agreements + disagreements + key insights>",
-        "future_work": "<gaps + hypotheses + concrete next steps>"
-      }
+_OVERVIEW_MARKER = "OVERVIEW:"
+_FUTURE_MARKER = "FUTURE_WORK:"
 
-    If anything fails, returns empty strings so caller can fall back.
-    """
-    if not api_key:
-        # No key in this environment → keep API alive, just skip LLM
-        return {"overview": "", "future_work": ""}
+logger = logging.getLogger(__name__)
 
-    # Build text describing the papers
-    if papers:
-        paper_text = "\n\n".join(
-            (
-                f"Title: {p.get('title', '')}\n"
-                f"Authors: {', '.join(p.get('authors', []) or [])}\n"
-                f"Published: {p.get('published', '')}\n"
-                f"Abstract: {p.get('summary', '')}\n"
-                f"URL: {p.get('url', '')}"
-            )
-            for p in papers
-        )
-    else:
-        paper_text = "No papers were retrieved for this topic."
+_PAPER_TEMPLATE = "Title: {title}\nAuthors: {authors}\nPublished: {published}\nAbstract: {summary}\nURL: {url}"
+_CALC_TEMPLATE = "{label}: {value} — {details}"
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
 
-    # Build text describing any calculations
-    if calculations:
-        calc_text = "\n".join(
-            f"{c.get('label', '')}: {c.get('value', '')} — {c.get('details', '')}"
-            for c in calculations
-        )
-    else:
-        calc_text = "No explicit calculations were performed."
-
-    prompt = f"""
+# Everything above ===INPUT=== is static so it is byte-identical across calls
+# (Gemini can only reuse a cached prompt prefix). Per-request data goes last.
+_PROMPT_TEMPLATE = """\
 You are an expert astrophysics research assistant.
 
-The user is asking about the topic:
-"{topic}"
-
-You are given a set of related papers:
-
-PAPERS:
-{paper_text}
-
-You are also given some basic astrophysical calculations (if any):
-
-CALCULATIONS:
-{calc_text}
+The user asks about a topic. Below the ===INPUT=== line you are given the topic,
+a set of related papers, and some basic astrophysical calculations (if any).
 
 Your job is NOT just to summarize.
 You must think like a researcher who is:
@@ -118,30 +81,314 @@ FUTURE_WORK:
 
 - Total length (both sections together) should be roughly 400–700 words.
 - Stay grounded in the given papers; avoid hallucinating new fake papers.
+
+===INPUT===
+Topic: "{topic}"
+
+PAPERS:
+{paper_text}
+
+CALCULATIONS:
+{calc_text}
 """
 
+
+@functools.cache
+def _genai():
+    """
+    Import and configure google.generativeai on first use, and only if
+    GEMINI_API_KEY is set (.env is loaded once by app.main). The SDK pulls in
+    the whole gRPC stack, so environments without a key never pay for it.
+    Returns None when there is no key.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai
+
+
+async def _embed_topic(topic: str) -> Optional[List[float]]:
+    """
+    Embedding for the semantic cache tier. Counts against the request limiter
+    like the generation calls. Returns None if the call fails, in which case
+    only the exact-match cache is used.
+    """
+    try:
+        await gemini_request_limiter.acquire()
+        result = await _genai().embed_content_async(
+            model=EMBEDDING_MODEL,
+            content=topic.strip().lower(),
+        )
+        return result["embedding"]
+    except Exception as e:
+        # Non-fatal (we just skip the semantic tier), so no traceback per failure
+        logger.warning("Gemini embedding error: %s", e)
+        return None
+
+
+def _condense(abstract: str, max_sentences: int = 3, max_chars: int = 600) -> str:
+    """
+    Shorten an abstract for the prompt: first few sentences, capped at max_chars
+    (cut on a word boundary). The opening of an abstract carries most of the
+    signal the report needs, and every character is billed input.
+    """
+    text = " ".join(abstract.split())  # arXiv abstracts are hard-wrapped
+    sentences = _SENTENCE_END_RE.split(text, maxsplit=max_sentences)
+    if len(sentences) > max_sentences:
+        text = " ".join(sentences[:max_sentences])
+
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + "…"
+    return text
+
+
+def _build_prompt(
+    topic: str,
+    papers: List[Dict[str, Any]],
+    calculations: List[Dict[str, Any]],
+) -> str:
+    # Build text describing the papers
+    if papers:
+        paper_text = "\n\n".join(
+            _PAPER_TEMPLATE.format(
+                title=p.get("title", ""),
+                authors=", ".join(p.get("authors", []) or []),
+                published=p.get("published", ""),
+                summary=_condense(p.get("summary", "")),
+                url=p.get("url", ""),
+            )
+            for p in papers
+        )
+    else:
+        paper_text = "No papers were retrieved for this topic."
+
+    # Build text describing any calculations
+    if calculations:
+        calc_text = "\n".join(
+            _CALC_TEMPLATE.format(
+                label=c.get("label", ""),
+                value=c.get("value", ""),
+                details=c.get("details", ""),
+            )
+            for c in calculations
+        )
+    else:
+        calc_text = "No explicit calculations were performed."
+
+    return _PROMPT_TEMPLATE.format_map(
+        {"topic": topic, "paper_text": paper_text, "calc_text": calc_text}
+    )
+
+
+async def _throttle(prompt: str) -> None:
+    """
+    Wait for one request slot and enough input-token budget (~4 chars/token).
+    """
+    await gemini_token_limiter.acquire(min(max(len(prompt) // 4, 1), GEMINI_TPM))
+    await gemini_request_limiter.acquire()
+
+
+async def _cached_report(
+    topic: str,
+    papers: List[Dict[str, Any]],
+    calculations: List[Dict[str, Any]],
+) -> Tuple[str, Optional[List[float]], Optional[Dict[str, str]]]:
+    """
+    Look the report up in the exact cache, then the semantic cache.
+    Returns (cache key, topic embedding, cached sections or None).
+    """
+    key = cache_key(MODEL_NAME, topic, papers, calculations)
+    cached = await report_cache.get(key)
+    if cached:
+        return key, None, cached
+
+    embedding = await _embed_topic(topic)
+    if embedding is not None:
+        cached = semantic_cache.get(embedding)
+        if cached:
+            # Promote to the exact tier so an identical repeat skips the embedding call
+            await report_cache.set(key, cached)
+    return key, embedding, cached
+
+
+async def _store_report(
+    key: str,
+    embedding: Optional[List[float]],
+    sections: Dict[str, str],
+) -> None:
+    if not sections.get("overview"):
+        return
+    await report_cache.set(key, sections)
+    if embedding is not None:
+        semantic_cache.set(embedding, sections)
+
+
+class _SectionSplitter:
+    """
+    Splits streamed model text into overview / future_work deltas on the
+    OVERVIEW: / FUTURE_WORK: markers. Text that could still be the start of a
+    marker is held back, so a marker split across two chunks is never emitted.
+    """
+
+    def __init__(self):
+        self.section = "overview"
+        self.parts: Dict[str, List[str]] = {"overview": [], "future_work": []}
+        self._buffer = ""
+        self._at_start = True
+        self._leading_marker_checked = False
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self._buffer += text
+        out: List[Tuple[str, str]] = []
+
+        if not self._leading_marker_checked:
+            head = self._buffer.lstrip()
+            if _OVERVIEW_MARKER.startswith(head):
+                # Might still be the start of a leading OVERVIEW: marker
+                return out
+            if head.startswith(_OVERVIEW_MARKER):
+                self._buffer = head[len(_OVERVIEW_MARKER):]
+            self._leading_marker_checked = True
+
+        if self.section == "overview" and _FUTURE_MARKER in self._buffer:
+            before, self._buffer = self._buffer.split(_FUTURE_MARKER, 1)
+            out += self._emit(before)
+            self.section = "future_work"
+            self._at_start = True
+
+        hold = len(_FUTURE_MARKER) - 1 if self.section == "overview" else 0
+        ready = len(self._buffer) - hold
+        if ready > 0:
+            out += self._emit(self._buffer[:ready])
+            self._buffer = self._buffer[ready:]
+        return out
+
+    def flush(self) -> List[Tuple[str, str]]:
+        out = self._emit(self._buffer)
+        self._buffer = ""
+        return out
+
+    def sections(self) -> Dict[str, str]:
+        return {name: "".join(chunks).strip() for name, chunks in self.parts.items()}
+
+    def _emit(self, text: str) -> List[Tuple[str, str]]:
+        if self.section == "overview":
+            text = text.replace(_OVERVIEW_MARKER, "")
+        if self._at_start:
+            text = text.lstrip()
+            if text:
+                self._at_start = False
+        if not text:
+            return []
+        self.parts[self.section].append(text)
+        return [(self.section, text)]
+
+
+async def generate_report(
+    topic: str,
+    papers: List[Dict[str, Any]],
+    calculations: List[Dict[str, Any]],
+) -> Dict[str, str]:
+    """
+    Ask Gemini to generate a structured scientific report.
+
+    Returns:
+      {
+        "overview": "<main narrative + agreements + disagreements + key insights>",
+        "future_work": "<gaps + hypotheses + concrete next steps>"
+      }
+
+    Results are cached for an hour, both by exact inputs and by topic similarity
+    (so paraphrased topics reuse an earlier report).
+
+    If anything fails, returns empty strings so caller can fall back.
+    """
+    genai = _genai()
+    if genai is None:
+        # No key in this environment → keep API alive, just skip LLM
+        return {"overview": "", "future_work": ""}
+
+    key, embedding, cached = await _cached_report(topic, papers, calculations)
+    if cached:
+        return cached
+
+    prompt = _build_prompt(topic, papers, calculations)
+
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
+        model = genai.GenerativeModel(MODEL_NAME)
+        await _throttle(prompt)
+        response = await model.generate_content_async(prompt)
         text = getattr(response, "text", "") or ""
 
         overview = ""
         future_work = ""
 
-        if "FUTURE_WORK:" in text:
-            before, after = text.split("FUTURE_WORK:", 1)
-            overview = before.replace("OVERVIEW:", "").strip()
+        if _FUTURE_MARKER in text:
+            before, after = text.split(_FUTURE_MARKER, 1)
+            overview = before.replace(_OVERVIEW_MARKER, "").strip()
             future_work = after.strip()
         else:
             # If model ignores markers, treat everything as overview
             overview = text.strip()
             future_work = ""
 
-        return {
+        sections = {
             "overview": overview,
             "future_work": future_work,
         }
 
-    except Exception as e:
-        print("Gemini report error:", e)
+        await _store_report(key, embedding, sections)
+        return sections
+
+    except Exception:
+        logger.exception("Gemini report error")
         return {"overview": "", "future_work": ""}
+
+
+async def generate_report_stream(
+    topic: str,
+    papers: List[Dict[str, Any]],
+    calculations: List[Dict[str, Any]],
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Streaming variant of generate_report.
+
+    Yields ("overview" | "future_work", text_delta) pairs as Gemini produces them,
+    all overview deltas first. A cached report is yielded as one delta per section.
+
+    If there is no API key or the call fails, stops early (possibly yielding
+    nothing) so the caller can fall back.
+    """
+    genai = _genai()
+    if genai is None:
+        return
+
+    key, embedding, cached = await _cached_report(topic, papers, calculations)
+    if cached:
+        for section in ("overview", "future_work"):
+            if cached.get(section):
+                yield section, cached[section]
+        return
+
+    prompt = _build_prompt(topic, papers, calculations)
+    splitter = _SectionSplitter()
+
+    try:
+        model = genai.GenerativeModel(MODEL_NAME)
+        await _throttle(prompt)
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            for delta in splitter.feed(chunk.text or ""):
+                yield delta
+    except Exception:
+        logger.exception("Gemini report stream error")
+        return
+
+    for delta in splitter.flush():
+        yield delta
+
+    await _store_report(key, embedding, splitter.sections())
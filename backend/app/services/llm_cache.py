@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis is optional; fall back to the in-memory backend
+    aioredis = None
+
+
+CACHE_TTL_SECONDS = 3600.0       # 1 hour, same as Gemini's default context cache TTL
+SEMANTIC_THRESHOLD = 0.92        # cosine similarity needed to reuse a paraphrased topic
+EXACT_MAX_ENTRIES = 512
+SEMANTIC_MAX_ENTRIES = 256
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(
+    model: str,
+    topic: str,
+    papers: List[Dict[str, Any]],
+    calculations: List[Dict[str, Any]],
+) -> str:
+    """
+    Exact cache key for a report: the model plus everything that goes into the prompt
+    that actually varies (topic, which papers, which calculations).
+    """
+    payload = {
+        "model": model,
+        "topic": topic.strip().lower(),
+        "papers": sorted(p.get("url", "") for p in papers),
+        "calcs": [c.get("label", "") for c in calculations],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> Optional[Dict[str, str]]: ...
+
+    async def set(self, key: str, value: Dict[str, str], ttl: float = CACHE_TTL_SECONDS) -> None: ...
+
+
+class MemoryCache:
+    """
+    Process-local LRU cache with a per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int = EXACT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple[float, Dict[str, str]]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict[str, str]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict[str, str], ttl: float = CACHE_TTL_SECONDS) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+class RedisCache:
+    """
+    Shared cache across worker processes, used when REDIS_URL is set.
+    """
+
+    def __init__(self, url: str, prefix: str = "astro:report:"):
+        self._client = aioredis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, str]]:
+        try:
+            raw = await self._client.get(self.prefix + key)
+        except Exception:
+            logger.exception("Redis cache get error")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Dict[str, str], ttl: float = CACHE_TTL_SECONDS) -> None:
+        try:
+            await self._client.set(self.prefix + key, json.dumps(value), ex=int(ttl))
+        except Exception:
+            logger.exception("Redis cache set error")
+
+
+class SemanticCache:
+    """
+    Small in-memory store of recent topic embeddings. A lookup is a single
+    matrix-vector product over all stored (unit-normalised) embeddings.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_THRESHOLD,
+        ttl: float = CACHE_TTL_SECONDS,
+        max_entries: int = SEMANTIC_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._vectors: Optional[np.ndarray] = None
+        self._expires: List[float] = []
+        self._values: List[Dict[str, str]] = []
+
+    @staticmethod
+    def _normalise(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        keep = [i for i, exp in enumerate(self._expires) if exp >= now]
+        if len(keep) == len(self._expires):
+            return
+        self._vectors = self._vectors[keep] if keep else None
+        self._expires = [self._expires[i] for i in keep]
+        self._values = [self._values[i] for i in keep]
+
+    def get(self, embedding: List[float]) -> Optional[Dict[str, str]]:
+        if self._vectors is None:
+            return None
+
+        self._evict_expired()
+        if self._vectors is None:
+            return None
+
+        scores = self._vectors @ self._normalise(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self._values[best]
+        return None
+
+    def set(self, embedding: List[float], value: Dict[str, str]) -> None:
+        vec = self._normalise(embedding)[np.newaxis, :]
+        if self._vectors is None:
+            self._vectors = vec
+        else:
+            self._vectors = np.vstack([self._vectors, vec])
+        self._expires.append(time.monotonic() + self.ttl)
+        self._values.append(value)
+
+        # Oldest entries are at the front
+        overflow = len(self._values) - self.max_entries
+        if overflow > 0:
+            self._vectors = self._vectors[overflow:]
+            self._expires = self._expires[overflow:]
+            self._values = self._values[overflow:]
+
+
+def _make_backend() -> CacheBackend:
+    url = os.getenv("REDIS_URL")
+    if url and aioredis is not None:
+        return RedisCache(url)
+    return MemoryCache()
+
+
+report_cache: CacheBackend = _make_backend()
+semantic_cache = SemanticCache()